@@ -1,25 +1,75 @@
+import asyncio
+import queue
+import threading
+import uuid
 import streamlit as st
-from typing import List, Dict, Optional
-from src.utils import upload_files_to_db
-from src.graph import graph
+from typing import Iterator, List, Dict, Optional
+from langchain_core.documents import Document
+from src.utils import iter_pdf_documents, upload_documents_to_db
+from src.graph import checkpointer, graph
+from src.database import QdrantDBManager, get_db_manager
 
 # Constants
 APP_TITLE = "DeepSeek R1"
 ALLOWED_FILE_TYPES = ["pdf"]
 LAYOUT_CONFIG = {"page_title": "DeepSeek Local", "layout": "wide"}
 
-def generate_response(user_input: str) -> Dict[str, str]:
-    """Generate AI response based on user input with thread persistence."""
+@st.cache_resource(show_spinner="Loading embedding model...")
+def load_db_manager() -> QdrantDBManager:
+    """Load the shared Qdrant manager (and its embedding model) once per server."""
+    return get_db_manager()
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start the background event loop that runs the async graph for all sessions."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def iter_uploaded_documents(uploaded_files: List) -> Iterator[Document]:
+    """Yield page Documents for the uploaded PDFs; extraction is cached per file."""
+    # Uploaded file objects are not reliably picklable; ship raw bytes to the workers
+    pdfs = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    return iter_pdf_documents(pdfs)
+
+def get_thread_config() -> Dict:
+    """Build the graph config for the current session's thread."""
+    # Use the per-session thread_id so sessions never share a checkpoint
+    return {"configurable": {"thread_id": st.session_state.thread_id}}
+
+def generate_response_stream(user_input: str) -> Iterator[str]:
+    """Stream the AI response token by token with thread persistence."""
     initial_state = {
         "question": user_input,
     }
-    # Use thread_id from session state
-    thread_id = st.session_state.get("thread_id", "default_thread")
-    response = graph.invoke(
-        initial_state,
-        config={"configurable": {"thread_id": thread_id}}
-    )
-    return response["answer"]  # Returns dict with 'reasoning' and 'response'
+    config = get_thread_config()
+    chunks: queue.Queue = queue.Queue()
+
+    async def consume_stream() -> None:
+        try:
+            async for chunk in graph.astream(initial_state, config=config, stream_mode="custom"):
+                chunks.put(chunk)
+        finally:
+            chunks.put(None)
+
+    # The graph runs on the shared loop; tokens are handed back to this script thread
+    future = asyncio.run_coroutine_threadsafe(consume_stream(), get_event_loop())
+    try:
+        while (chunk := chunks.get()) is not None:
+            # Label the reasoning block the same way the final message renders it
+            yield chunk.replace("<think>", "#### Reasoning:\n").replace(
+                "</think>", "\n\n#### Response:\n"
+            )
+    finally:
+        # Streamlit closes this generator when it interrupts the script; stop the
+        # run so an answer the user never saw isn't written into the thread's history
+        if not future.done():
+            future.cancel()
+    future.result()  # Re-raise any error from the graph run
+
+def get_last_answer() -> Dict[str, str]:
+    """Return the answer stored by the last graph run for this thread."""
+    return graph.get_state(get_thread_config()).values["answer"]  # Dict with 'reasoning' and 'response'
 
 class ChatState:
     """Manages session state initialization and updates"""
@@ -32,7 +82,7 @@ class ChatState:
             "files_upload_complete": False,
             "messages": [],
             "uploader_key": 0,
-            "thread_id": "default_thread"  # Persistent thread ID
+            "thread_id": str(uuid.uuid4())  # Persistent thread ID, unique per session
         }
         for key, value in defaults.items():
             if key not in st.session_state:
@@ -40,8 +90,11 @@ class ChatState:
 
     @staticmethod
     def clear_messages():
-        """Clear chat messages"""
+        """Clear chat messages and start a fresh conversation thread"""
         st.session_state.messages = []
+        # Free the old thread's checkpoints before switching to a new one
+        checkpointer.delete_thread(st.session_state.thread_id)
+        st.session_state.thread_id = str(uuid.uuid4())
 
 def render_header() -> None:
     """Render the application header and controls"""
@@ -78,7 +131,7 @@ def process_uploaded_files(selected_files: List) -> None:
         with upload_button_placeholder.container():
             if st.button("Upload Files", use_container_width=True):
                 with st.status("Uploading files...", expanded=False) as status:
-                    if upload_files_to_db(selected_files):
+                    if upload_documents_to_db(iter_uploaded_documents(selected_files)):
                         st.session_state.files_upload_complete = True
                         st.session_state.selected_files_ready = False
                         st.session_state.uploader_key += 1
@@ -88,6 +141,13 @@ def process_uploaded_files(selected_files: List) -> None:
                         expanded=False
                     )
 
+def render_assistant_message(content: Dict[str, str]) -> None:
+    """Render an assistant answer with reasoning and response separated."""
+    st.write("#### Reasoning:")
+    st.write(content.get("reasoning", "No reasoning provided"))
+    st.write("#### Response:")
+    st.write(content.get("response", "No response generated"))
+
 def display_chat_history() -> None:
     """Display chat message history with reasoning and response separated."""
     for message in st.session_state.messages:
@@ -95,37 +155,46 @@ def display_chat_history() -> None:
             if message["role"] == "user":
                 st.write(message["content"])
             else:  # Assistant message
-                content = message["content"]  # This is a dict with reasoning/response
-                st.write("#### Reasoning:")
-                st.write(content.get("reasoning", "No reasoning provided"))
-                st.write("#### Response:")
-                st.write(content.get("response", "No response generated"))
-
-def handle_user_input() -> None:
-    """Handle user input and display responses"""
+                render_assistant_message(message["content"])  # This is a dict with reasoning/response
+
+def handle_user_input(messages) -> None:
+    """Handle user input and display responses in the given messages container"""
     if user_input := st.chat_input("Type your question here..."):
         # Add user message
         st.session_state.messages.append({"role": "user", "content": user_input})
-        with st.chat_message("user"):
+        with messages, st.chat_message("user"):
             st.write(user_input)
 
-        # Generate and display assistant response
-        assistant_response = generate_response(user_input)
+        # Stream the assistant response, then re-render it in its final layout
+        with messages, st.chat_message("assistant"):
+            placeholder = st.empty()
+            with placeholder.container():
+                st.write_stream(generate_response_stream(user_input))
+
+            assistant_response = get_last_answer()
+            with placeholder.container():
+                render_assistant_message(assistant_response)
+
         st.session_state.messages.append({
             "role": "assistant",
             "content": assistant_response  # Store the full dict
         })
 
-        with st.chat_message("assistant"):
-            st.write("#### Reasoning:")
-            st.write(assistant_response.get("reasoning", "No reasoning provided"))
-            st.write("#### Response:")
-            st.write(assistant_response.get("response", "No response generated"))
+@st.fragment
+def chat_panel() -> None:
+    """Chat area; reruns on its own so chat input doesn't rerun the upload sidebar"""
+    # Inside a fragment the chat input renders inline, so new turns go into a
+    # container above it to keep them in order with the history
+    messages = st.container()
+    with messages:
+        display_chat_history()
+    handle_user_input(messages)
 
 def main() -> None:
     """Main application function"""
     st.set_page_config(**LAYOUT_CONFIG)
     ChatState.initialize()
+    load_db_manager()
     
     render_header()
     selected_files = handle_file_upload()
@@ -133,8 +202,7 @@ def main() -> None:
     if selected_files:
         process_uploaded_files(selected_files)
     
-    display_chat_history()
-    handle_user_input()
+    chat_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,21 @@
-from typing import List
+import asyncio
+import uuid
+from functools import lru_cache
+from typing import Iterable, List, Optional
 from langchain_core.documents import Document
-from langchain_experimental.text_splitter import SemanticChunker
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, Distance, VectorParams
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import (
+    PointStruct,
+    Distance,
+    VectorParams,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType
+)
 
 from src.embeddings import MiniLMEmbeddings
 
@@ -12,11 +23,18 @@ from src.embeddings import MiniLMEmbeddings
 DB_CONFIG = {
     "HOST": "localhost",
     "PORT": 6333,
+    "GRPC_PORT": 6334,
     "COLLECTION_NAME": "deep_seek_storage",
     "VECTOR_SIZE": 384,  # Matches MiniLM embedding size; consider LLM context window
-    "DISTANCE": Distance.COSINE
+    "DISTANCE": Distance.DOT,  # Embeddings are L2-normalized, so DOT equals cosine
+    "UPSERT_BATCH_SIZE": 256,
+    "MIN_CHUNK_CHARS": 32  # Shorter chunks carry too little text to be worth embedding
 }
 
+def _point_id(doc: Document) -> str:
+    """Derive a stable point ID from chunk content so re-uploads map to the same point."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, doc.page_content))
+
 class QdrantDBManager:
     """Manages interactions with Qdrant vector database."""
     
@@ -29,7 +47,9 @@ class QdrantDBManager:
         """
         Create the main database collection if it doesn't exist.
         
-        Uses the configured collection name and vector parameters.
+        Uses the configured collection name and vector parameters. The HNSW graph
+        lives on disk, segments are memory-mapped past 20k vectors, and an int8
+        copy of the vectors is kept in RAM for fast scoring.
         """
         if not self.client.collection_exists(DB_CONFIG["COLLECTION_NAME"]):
             self.client.create_collection(
@@ -37,12 +57,21 @@ class QdrantDBManager:
                 vectors_config=VectorParams(
                     size=DB_CONFIG["VECTOR_SIZE"],
                     distance=DB_CONFIG["DISTANCE"]
+                ),
+                hnsw_config=HnswConfigDiff(m=16, ef_construct=100, on_disk=True),
+                optimizers_config=OptimizersConfigDiff(memmap_threshold=20000),
+                quantization_config=ScalarQuantization(
+                    scalar=ScalarQuantizationConfig(
+                        type=ScalarType.INT8,
+                        quantile=0.99,
+                        always_ram=True
+                    )
                 )
             )
 
     def split_documents(self, documents: List[Document]) -> List[Document]:
         """
-        Split documents into chunks using semantic and character-based splitting.
+        Split documents into overlapping chunks using character-based splitting.
         
         Args:
             documents: List of Document objects to split
@@ -50,16 +79,13 @@ class QdrantDBManager:
         Returns:
             List of split Document objects
         """
-        # Semantic splitting for meaningful chunks
-        semantic_splitter = SemanticChunker(self.embeddings)
-        semantic_docs = semantic_splitter.split_documents(documents)
-        
-        # Further split into smaller chunks with overlap
+        # Prefer paragraph, line and sentence boundaries before falling back to words
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=2000,
-            chunk_overlap=400
+            chunk_overlap=400,
+            separators=["\n\n", "\n", ". ", " "]
         )
-        return text_splitter.split_documents(semantic_docs)
+        return text_splitter.split_documents(documents)
 
     def generate_points(self, split_docs: List[Document]) -> List[PointStruct]:
         """
@@ -69,73 +95,185 @@ class QdrantDBManager:
             split_docs: List of split Document objects
             
         Returns:
-            List of PointStruct objects with vectors and payloads
+            List of PointStruct objects with vectors and payloads; chunks shorter
+            than MIN_CHUNK_CHARS (e.g. whitespace or page-number fragments) are dropped
         """
-        # Generate embeddings for all document contents
+        # Skip near-empty chunks so they don't cost a transformer forward pass
+        split_docs = [
+            doc for doc in split_docs
+            if len(doc.page_content.strip()) >= DB_CONFIG["MIN_CHUNK_CHARS"]
+        ]
+        if not split_docs:
+            return []
+        
+        # Generate embeddings for all document contents in a single batch
         vectors = self.embeddings.embed_documents(
             [doc.page_content for doc in split_docs]
         )
         
-        # Create points with IDs, vectors, and payloads
+        # Create points with content-derived IDs, vectors, and payloads
         return [
             PointStruct(
-                id=i,
+                id=_point_id(doc),
                 vector=vector,
                 payload={
                     "page_content": doc.page_content or "",
                     "metadata": doc.metadata or {}
                 }
             )
-            for i, (vector, doc) in enumerate(zip(vectors, split_docs))
+            for vector, doc in zip(vectors, split_docs)
         ]
 
-    def add_documents(self, documents: List[Document]) -> None:
+    async def _aadd_documents(self, documents: Iterable[Document]) -> None:
+        """
+        Split, embed and upsert documents batch by batch over gRPC.
+        
+        Documents are pulled from the iterator one at a time and split as they
+        arrive; every UPSERT_BATCH_SIZE chunks are embedded and queued for upsert.
+        Chunks whose content-derived ID is already in the collection are not
+        re-embedded, so uploading the same PDF twice costs only the ID lookups.
+        
+        Embedding of the next batch overlaps with the upsert of the previous one;
+        the bounded queue keeps at most two embedded batches waiting in memory.
+        
+        Args:
+            documents: Document objects to store; may be a lazy iterator
+        """
+        client = AsyncQdrantClient(
+            host=DB_CONFIG["HOST"],
+            port=DB_CONFIG["PORT"],
+            grpc_port=DB_CONFIG["GRPC_PORT"],
+            prefer_grpc=True
+        )
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        batch_size = DB_CONFIG["UPSERT_BATCH_SIZE"]
+        loop = asyncio.get_running_loop()
+        documents_iter = iter(documents)
+
+        def split_next() -> Optional[List[Document]]:
+            # Pulling the next document may block on PDF extraction
+            doc = next(documents_iter, None)
+            return None if doc is None else self.split_documents([doc])
+
+        async def embed_batch(batch: List[Document]) -> None:
+            # Key by point ID so chunks repeated within the batch are embedded once
+            new_docs = {_point_id(doc): doc for doc in batch}
+            
+            # Skip chunks already stored by a previous upload
+            stored = await client.retrieve(
+                collection_name=DB_CONFIG["COLLECTION_NAME"],
+                ids=list(new_docs),
+                with_payload=False,
+                with_vectors=False
+            )
+            for record in stored:
+                new_docs.pop(str(record.id), None)
+            if not new_docs:
+                return
+            
+            # Run the CPU-bound encode off the event loop so upserts keep flowing
+            points = await loop.run_in_executor(
+                None, self.generate_points, list(new_docs.values())
+            )
+            if points:
+                await queue.put(points)
+
+        async def embed_batches() -> None:
+            pending: List[Document] = []
+            exhausted = False
+            while not exhausted or pending:
+                if not exhausted and len(pending) < batch_size:
+                    split_docs = await loop.run_in_executor(None, split_next)
+                    if split_docs is None:
+                        exhausted = True
+                    else:
+                        pending.extend(split_docs)
+                    continue
+                
+                await embed_batch(pending[:batch_size])
+                pending = pending[batch_size:]
+            await queue.put(None)
+
+        async def upsert_batches() -> None:
+            while (points := await queue.get()) is not None:
+                # Wait for each write to be applied so errors surface and the
+                # documents are searchable once add_documents returns
+                await client.upsert(
+                    collection_name=DB_CONFIG["COLLECTION_NAME"],
+                    points=points,
+                    wait=True
+                )
+
+        try:
+            await asyncio.gather(embed_batches(), upsert_batches())
+        finally:
+            await client.close()
+
+    def add_documents(self, documents: Iterable[Document]) -> None:
         """
         Add documents to the Qdrant vector store.
         
         Args:
-            documents: List of Document objects to process and store
+            documents: Document objects to process and store; may be a lazy
+                iterator, which is consumed by a single ingest pipeline run
         """
         # Ensure collection exists before adding documents
         self._ensure_collection_exists()
         
-        # Split documents into manageable chunks
-        split_docs = self.split_documents(documents)
+        # Split, embed and upload points to Qdrant in pipelined batches
+        asyncio.run(self._aadd_documents(documents))
+
+    def _collection_distance(self) -> Distance:
+        """
+        Get the distance metric of the existing collection.
+        
+        Collections created before the switch to DOT still use COSINE. Both rank
+        normalized embeddings identically, so the existing metric is kept until
+        the collection is re-indexed.
         
-        # Generate points with embeddings
-        points = self.generate_points(split_docs)
+        Returns:
+            Distance of the existing collection, or the configured one if it doesn't exist yet
+        """
+        if not self.client.collection_exists(DB_CONFIG["COLLECTION_NAME"]):
+            return DB_CONFIG["DISTANCE"]
         
-        # Upload points to Qdrant
-        self.client.upload_points(
-            collection_name=DB_CONFIG["COLLECTION_NAME"],
-            points=points
-        )
+        info = self.client.get_collection(DB_CONFIG["COLLECTION_NAME"])
+        distance = info.config.params.vectors.distance
+        if distance != DB_CONFIG["DISTANCE"]:
+            print(
+                f"Collection '{DB_CONFIG['COLLECTION_NAME']}' uses {distance.value} distance; "
+                f"re-index it to use {DB_CONFIG['DISTANCE'].value}"
+            )
+        return distance
 
     def get_vector_store(self) -> QdrantVectorStore:
         """
         Retrieve the Qdrant vector store instance.
         
         Returns:
-            QdrantVectorStore configured with client and embeddings
+            QdrantVectorStore configured with client, embeddings and the collection's distance
         """
         return QdrantVectorStore(
             client=self.client,
             collection_name=DB_CONFIG["COLLECTION_NAME"],
-            embedding=self.embeddings
+            embedding=self.embeddings,
+            distance=self._collection_distance()
         )
 
 # Exposed functions for external use
+@lru_cache(maxsize=1)
+def get_db_manager() -> QdrantDBManager:
+    """Get the process-wide Qdrant manager, creating it on first use."""
+    return QdrantDBManager()
+
 def create_main_db_collection() -> None:
     """Create the main database collection if it doesn't exist."""
-    manager = QdrantDBManager()
-    manager._ensure_collection_exists()
+    get_db_manager()._ensure_collection_exists()
 
-def add_documents(documents: List[Document]) -> None:
+def add_documents(documents: Iterable[Document]) -> None:
     """Add documents to the Qdrant vector store."""
-    manager = QdrantDBManager()
-    manager.add_documents(documents)
+    get_db_manager().add_documents(documents)
 
 def get_vector_store() -> QdrantVectorStore:
     """Get the configured Qdrant vector store instance."""
-    manager = QdrantDBManager()
-    return manager.get_vector_store()
\ No newline at end of file
+    return get_db_manager().get_vector_store()
\ No newline at end of file
@@ -1,12 +1,31 @@
+from functools import lru_cache
 from sentence_transformers import SentenceTransformer
-from langchain.embeddings.base import Embeddings
+from langchain_core.embeddings import Embeddings
+
+@lru_cache(maxsize=1)
+def _load_minilm() -> SentenceTransformer:
+    """Load the MiniLM model once per process and reuse it afterwards."""
+    return SentenceTransformer("all-MiniLM-L6-v2")
 
 class MiniLMEmbeddings(Embeddings):
     def __init__(self):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.model = _load_minilm()
         
     def embed_documents(self, texts):
-        return self.model.encode(texts).tolist()
+        # One batched forward pass for the whole chunk list
+        vectors = self.model.encode(
+            texts,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return vectors.tolist()
     
     def embed_query(self, text):
-        return self.model.encode(text).tolist()
\ No newline at end of file
+        return self.model.encode(
+            text,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).tolist()
\ No newline at end of file
@@ -1,81 +1,143 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List
+import httpx
+import numpy as np
 from langgraph.graph import START, END, StateGraph
 from langchain_ollama.llms import OllamaLLM
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
 from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.runnables import RunnableConfig
+from langgraph.types import StreamWriter
 from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
 
 from src.utils import parse_output
-from src.database import get_vector_store
+from src.database import get_db_manager, get_vector_store
 from src.prompts import basic_prompt, summary_prompt, retrieval_prompt
 from src.state import DeepSeekState
 
 # Ollama API endpoint (adjust if your Docker port/host differs)
 OLLAMA_BASE_URL = "http://localhost:11434"
+LLM_MODEL = "deepseek-r1:1.5b"
+
+# Cosine similarity bounds between consecutive questions; the LLM only decides in between
+REUSE_CONTEXT_SIMILARITY = 0.8
+RETRIEVE_SIMILARITY = 0.5
+
+# Keep idle connections to Ollama open across turns instead of reconnecting
+OLLAMA_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300)
+
+@lru_cache(maxsize=1)
+def get_llm() -> OllamaLLM:
+    """Get the shared Ollama client so all nodes reuse one connection pool."""
+    return OllamaLLM(
+        model=LLM_MODEL,
+        base_url=OLLAMA_BASE_URL,
+        client_kwargs={"limits": OLLAMA_HTTP_LIMITS}
+    )
+
+@lru_cache(maxsize=1)
+def get_retriever() -> VectorStoreRetriever:
+    """Get the shared retriever over the Qdrant vector store."""
+    vectorstore = get_vector_store()
+    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 3})
 
-def analyze_retrieval_need(state: DeepSeekState) -> DeepSeekState:
+async def analyze_retrieval_need(state: DeepSeekState) -> DeepSeekState:
     """
-    Use an LLM to determine if new document retrieval is needed based on history and current question.
+    Determine if new document retrieval is needed based on history and current question.
+
+    Questions that are clearly similar to (or clearly different from) the previous one
+    are routed by embedding similarity; only ambiguous cases are sent to the LLM.
     """
-    print("Analyzing retrieval need with LLM")
+    print("Analyzing retrieval need")
     current_question = state["question"]
     history = state.get("history", [])
 
     if not history:
         return {"needs_retrieval": True}
 
-    history_text = "\n".join(
-        [f"Q: {entry['question']}\nA: {entry['answer']}" for entry in history]
+    # Embeddings are L2-normalized, so the dot product is the cosine similarity
+    current_vector, previous_vector = np.asarray(
+        await get_db_manager().embeddings.aembed_documents(
+            [current_question, history[-1]["question"]]
+        )
     )
+    similarity = float(np.dot(current_vector, previous_vector))
 
-    model = OllamaLLM(model="deepseek-r1:1.5b", base_url=OLLAMA_BASE_URL)
+    if similarity > REUSE_CONTEXT_SIMILARITY and history[-1]["context"]:
+        print(f"Similarity {similarity:.2f}: Reuse context")
+        return {"needs_retrieval": False, "context": history[-1]["context"]}
+    # A similar question with no previous context has nothing to reuse
+    if similarity > REUSE_CONTEXT_SIMILARITY or similarity < RETRIEVE_SIMILARITY:
+        print(f"Similarity {similarity:.2f}: Retrieve")
+        return {"needs_retrieval": True}
+
+    print(f"Similarity {similarity:.2f}: Asking LLM")
+    model = get_llm()
     messages = retrieval_prompt.invoke({
         "current_question": current_question,
-        "history": history_text
+        "history": state.get("history_text", "")
     })
-    response = model.invoke(messages).strip().upper()
-    needs_retrieval = response == "YES"
+    # Drop the <think> block so only the final YES/NO decision is checked
+    response = parse_output(await model.ainvoke(messages))["response"]
+    needs_retrieval = response.strip().upper().startswith("YES")
     print(f"LLM decision: {'Retrieve' if needs_retrieval else 'Reuse context'}")
 
     if not needs_retrieval and history[-1]["context"]:
         return {"needs_retrieval": False, "context": history[-1]["context"]}
     return {"needs_retrieval": True}
 
-def retrieve(state: DeepSeekState) -> DeepSeekState:
+async def retrieve(state: DeepSeekState) -> DeepSeekState:
     """
     Retrieve documents if needed, otherwise use existing context.
     """
     if not state.get("needs_retrieval", True):
         print("Skipping retrieval, using existing context")
-        return state
+        return {}
 
     print("Retrieving new documents")
     query = state["question"]
-    vectorstore = get_vector_store()
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-    documents = retriever.invoke(query)
+    documents = await get_retriever().ainvoke(query)
     return {"context": documents}
 
-def summarize_history(state: DeepSeekState) -> DeepSeekState:
+async def summarize_history(state: DeepSeekState) -> DeepSeekState:
     """
-    Summarize previous context and answers for use in generation.
+    Fold turns not yet covered into the rolling summary for use in generation.
+
+    Only the previous summary and the new question/answer pairs (normally just the
+    last one) are sent to the LLM, so the cost per turn stays constant as the
+    conversation grows. Tracking summarized_turns keeps this idempotent when a run
+    is interrupted after the summary is saved but before generate adds its turn.
     """
     print("Summarizing history")
     history = state.get("history", [])
     if not history:
-        return {"summary": ""}
+        return {"summary": "", "summarized_turns": 0}
+
+    new_turns = history[state.get("summarized_turns", 0):]
+    if not new_turns:
+        return {}
 
     past_contexts = "\n".join(
-        [f"Q: {entry['question']}\nA: {entry['answer']}" for entry in history]
+        [f"Q: {entry['question']}\nA: {entry['answer']['response']}" for entry in new_turns]
     )
+    previous_summary = state.get("summary", "")
+    if previous_summary:
+        past_contexts = f"{previous_summary}\n\n{past_contexts}"
     
-    model = OllamaLLM(model="deepseek-r1:1.5b", base_url=OLLAMA_BASE_URL)
+    model = get_llm()
     messages = summary_prompt.invoke({"text": past_contexts})
-    summary = model.invoke(messages)
-    return {"summary": parse_output(summary)}
+    summary = await model.ainvoke(messages)
+    return {"summary": parse_output(summary)["response"], "summarized_turns": len(history)}
 
-def generate(state: DeepSeekState) -> DeepSeekState:
+async def generate(state: DeepSeekState, writer: StreamWriter) -> DeepSeekState:
     """
     Generate a response using current context and summarized history.
+
+    Tokens are forwarded to the "custom" stream as they arrive; the full text is
+    parsed and stored in history once generation completes.
     """
     print("Generating Response")
     docs_contents = "\n\n".join([doc.page_content for doc in state["context"]])
@@ -86,9 +148,12 @@ def generate(state: DeepSeekState) -> DeepSeekState:
         "context": f"Previous Summary: {summary}\n\nCurrent Context: {docs_contents}"
     })
 
-    model = OllamaLLM(model="deepseek-r1:1.5b", base_url=OLLAMA_BASE_URL)
-    response = model.invoke(messages)
-    answer = parse_output(response)
+    model = get_llm()
+    chunks = []
+    async for chunk in model.astream(messages):
+        chunks.append(chunk)
+        writer(chunk)
+    answer = parse_output("".join(chunks))
     
     new_history = state.get("history", []) + [{
         "question": state["question"],
@@ -96,7 +161,12 @@ def generate(state: DeepSeekState) -> DeepSeekState:
         "answer": answer
     }]
     
-    return {"answer": answer, "history": new_history}
+    # Append only the new turn instead of re-joining the whole history next turn
+    turn_text = f"Q: {state['question']}\nA: {answer['response']}"
+    history_text = state.get("history_text", "")
+    history_text = f"{history_text}\n{turn_text}" if history_text else turn_text
+    
+    return {"answer": answer, "history": new_history, "history_text": history_text}
 
 builder = StateGraph(DeepSeekState)
 builder.add_node("analyze_retrieval", analyze_retrieval_need)
@@ -104,11 +174,51 @@ builder.add_node("retrieve", retrieve)
 builder.add_node("summarize_history", summarize_history)
 builder.add_node("generate", generate)
 
+# Retrieval analysis and summarization only depend on history, so they run
+# concurrently and their Ollama requests can share a batch
 builder.add_edge(START, "analyze_retrieval")
+builder.add_edge(START, "summarize_history")
 builder.add_edge("analyze_retrieval", "retrieve")
-builder.add_edge("retrieve", "summarize_history")
-builder.add_edge("summarize_history", "generate")
+builder.add_edge(["retrieve", "summarize_history"], "generate")
 builder.add_edge("generate", END)
 
-checkpointer = MemorySaver()
+class BoundedMemorySaver(MemorySaver):
+    """
+    In-memory checkpointer that keeps only the most recently used threads.
+
+    Every Streamlit session (and every Clear Chat) gets its own thread, and nothing
+    signals when a session ends, so the least recently written threads are evicted
+    once more than max_threads are stored.
+    """
+
+    def __init__(self, max_threads: int = 64):
+        super().__init__()
+        self.max_threads = max_threads
+        self._thread_order: "OrderedDict[str, None]" = OrderedDict()
+        self._thread_lock = threading.Lock()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        with self._thread_lock:
+            self._thread_order[thread_id] = None
+            self._thread_order.move_to_end(thread_id)
+            evicted = []
+            while len(self._thread_order) > self.max_threads:
+                evicted.append(self._thread_order.popitem(last=False)[0])
+        for old_thread_id in evicted:
+            super().delete_thread(old_thread_id)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._thread_lock:
+            self._thread_order.pop(str(thread_id), None)
+        super().delete_thread(thread_id)
+
+checkpointer = BoundedMemorySaver()
 graph = builder.compile(checkpointer=checkpointer)
\ No newline at end of file
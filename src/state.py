@@ -6,4 +6,7 @@ class DeepSeekState(TypedDict):
     context: List[Document]    # Current retrieved documents
     answer: str                # Current generated answer
     history: List[dict]        # List of previous {question, context, answer}
-    needs_retrieval: bool      # Flag to determine if new retrieval is needed
\ No newline at end of file
+    needs_retrieval: bool      # Flag to determine if new retrieval is needed
+    summary: str               # Rolling summary of the conversation so far
+    summarized_turns: int      # Number of history entries already folded into summary
+    history_text: str          # History rendered as "Q: ...\nA: ..." lines, appended each turn
\ No newline at end of file
@@ -1,12 +1,21 @@
+import hashlib
+import itertools
+import os
 import re
-from typing import List, Optional, Dict, Any, Type
-from PyPDF2 import PdfReader
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Dict, Any, Tuple, Type
+import pypdfium2 as pdfium
 from langchain_core.documents import Document
 from ollama import chat
 from pydantic import BaseModel
 
 from src.database import add_documents
 
+_THINK_RE = re.compile(r'<think>(.*?)</think>', re.DOTALL)
+
 class ParseOutputResult(BaseModel):
     """Pydantic model for structured parse output."""
     reasoning: str
@@ -25,60 +34,146 @@ def parse_output(text: str) -> Dict[str, str]:
     Raises:
         AttributeError: If regex pattern doesn't match expected format.
     """
-    think_match = re.search(r'<think>(.*?)</think>', text, re.DOTALL)
-    output_match = re.search(r'</think>\s*(.*?)$', text, re.DOTALL)
-
-    reasoning = think_match.group(1).strip() if think_match else ""
-    response = output_match.group(1).strip() if output_match else text.strip()
+    think_match = _THINK_RE.search(text)
+    if think_match:
+        reasoning = think_match.group(1).strip()
+        response = text[think_match.end():].strip()
+    else:
+        # Tolerate a missing opening tag: everything after </think> is the response
+        _, closed, tail = text.partition("</think>")
+        reasoning = ""
+        response = (tail if closed else text).strip()
 
     return {"reasoning": reasoning, "response": response}
 
-def extract_text_from_pdf(pdf_file: Any) -> str:
+def iter_pdf_pages(pdf_file: Any) -> Iterator[Tuple[int, str]]:
     """
-    Extract text from a PDF file.
+    Lazily extract text from a PDF file, one page at a time.
 
     Args:
-        pdf_file: Uploaded file object (e.g., from Streamlit file_uploader).
+        pdf_file: PDF contents as bytes, a file path, or a binary file-like object.
 
-    Returns:
-        Concatenated text from all pages in the PDF.
+    Yields:
+        Tuples of (1-based page number, page text) for pages with extractable text.
 
     Raises:
-        PyPDF2.errors.PdfReadError: If the PDF file is corrupted or unreadable.
+        pypdfium2.PdfiumError: If the PDF file is corrupted or unreadable.
+    """
+    pdf = pdfium.PdfDocument(pdf_file)
+    try:
+        for page_index in range(len(pdf)):
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            if text:
+                # PDFium separates lines with CRLF
+                yield page_index + 1, text.replace("\r\n", "\n")
+    finally:
+        pdf.close()
+
+def extract_pdf_documents(file_name: str, file_bytes: bytes) -> List[Document]:
+    """
+    Extract one Document per page from a PDF.
+
+    Args:
+        file_name: Name stored in each Document's metadata.
+        file_bytes: PDF file contents.
+
+    Returns:
+        Document per page with text, in page order.
     """
-    reader = PdfReader(pdf_file)
-    text_pages = [
-        page.extract_text() for page in reader.pages if page.extract_text() is not None
+    return [
+        Document(
+            page_content=page_text,
+            metadata={"file_name": file_name, "page": page_number}
+        )
+        for page_number, page_text in iter_pdf_pages(file_bytes)
     ]
-    return "\n".join(text_pages)
 
-def upload_files_to_db(uploaded_files: List[Any]) -> bool:
+# Number of extracted PDFs kept in memory so re-uploads skip extraction
+PDF_CACHE_SIZE = 32
+
+_pdf_cache: "OrderedDict[Tuple[str, str], List[Document]]" = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Get the shared extraction pool; PDFium is not thread-safe, so it only runs in workers."""
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+
+def _get_cached_documents(key: Tuple[str, str]) -> Optional[List[Document]]:
+    """Look up extracted pages by (content hash, file name), marking them recently used."""
+    with _pdf_cache_lock:
+        documents = _pdf_cache.get(key)
+        if documents is not None:
+            _pdf_cache.move_to_end(key)
+        return documents
+
+def _cache_documents(key: Tuple[str, str], documents: List[Document]) -> None:
+    """Store extracted pages, evicting the least recently used PDF beyond PDF_CACHE_SIZE."""
+    with _pdf_cache_lock:
+        _pdf_cache[key] = documents
+        _pdf_cache.move_to_end(key)
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+
+def iter_pdf_documents(pdfs: List[Tuple[str, bytes]]) -> Iterator[Document]:
+    """
+    Yield one Document per page for each PDF, in file and page order.
+
+    PDFs are cached per file, keyed on a hash of their contents. Uncached files are
+    all submitted to the worker pool up front, so they are extracted in parallel
+    while earlier files are already being consumed.
+
+    Args:
+        pdfs: Tuples of (file name, PDF file contents).
+
+    Yields:
+        Document per page with text.
     """
-    Convert uploaded PDF files to Documents and store them in the vector database.
+    keys = [(hashlib.sha256(file_bytes).hexdigest(), file_name) for file_name, file_bytes in pdfs]
+    executor = _get_pdf_executor()
+
+    futures = {}
+    for key, (file_name, file_bytes) in zip(keys, pdfs):
+        if key not in futures and _get_cached_documents(key) is None:
+            futures[key] = executor.submit(extract_pdf_documents, file_name, file_bytes)
+
+    try:
+        for key, (file_name, file_bytes) in zip(keys, pdfs):
+            documents = _get_cached_documents(key)
+            if documents is None:
+                # Re-submit if the entry was evicted after the lookup above
+                future = futures.get(key) or executor.submit(
+                    extract_pdf_documents, file_name, file_bytes
+                )
+                documents = future.result()
+                _cache_documents(key, documents)
+            yield from documents
+    finally:
+        # Don't keep extracting files nobody will read
+        for future in futures.values():
+            future.cancel()
+
+def upload_documents_to_db(documents: Iterable[Document]) -> bool:
+    """
+    Store documents in the vector database in a single streaming ingest run.
 
     Args:
-        uploaded_files: List of uploaded file objects (e.g., from Streamlit file_uploader).
+        documents: Documents to store; may be a lazy iterator.
 
     Returns:
         True if documents were successfully uploaded, False otherwise.
     """
-    documents = []
-
-    for uploaded_file in uploaded_files:
-        file_name = uploaded_file.name
-        file_text = extract_text_from_pdf(uploaded_file)
-
-        if file_text:
-            doc = Document(
-                page_content=file_text,
-                metadata={"file_name": file_name}
-            )
-            documents.append(doc)
-
-    if documents:
-        add_documents(documents)
-        return True
-    return False
+    documents = iter(documents)
+    first = next(documents, None)
+    if first is None:
+        return False
+
+    add_documents(itertools.chain([first], documents))
+    return True
 
 def invoke_ollama(
     model: str,